@@ -0,0 +1,63 @@
+"""Rewrite faiss_index/index.faiss as a different FAISS index type.
+
+index.pkl maps FAISS row ids to docstore ids, so only the vectors are
+re-indexed; the row order (and therefore index.pkl) stays valid.
+
+Vectors are L2-normalised and stored under inner product by default, so
+cosine similarity is a plain dot product at query time (main.py normalises
+the query vectors to match).
+
+    python build_index.py hnsw     # graph index, sub-linear search for large corpora
+    python build_index.py flat     # exact scan, best for a few thousand vectors
+    python build_index.py sq8      # 8-bit scalar quantised scan, 4x fewer bytes per vector
+
+sq8 is lossy: vectors read back from it are the quantised ones, so convert
+from a flat or hnsw index rather than from a previous sq8 build.
+"""
+import argparse
+import faiss
+
+INDEX_PATH           = "faiss_index/index.faiss"
+HNSW_M               = 32    # graph neighbours per node
+HNSW_EF_CONSTRUCTION = 200
+
+def build_flat(xb, metric):
+    index = faiss.IndexFlat(xb.shape[1], metric)
+    index.add(xb)
+    return index
+
+def build_hnsw(xb, metric):
+    index = faiss.IndexHNSWFlat(xb.shape[1], HNSW_M, metric)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.add(xb)
+    return index
+
+def build_sq8(xb, metric):
+    index = faiss.IndexScalarQuantizer(xb.shape[1], faiss.ScalarQuantizer.QT_8bit, metric)
+    index.train(xb)
+    index.add(xb)
+    return index
+
+BUILDERS = {"flat": build_flat, "hnsw": build_hnsw, "sq8": build_sq8}
+METRICS  = {"ip": faiss.METRIC_INNER_PRODUCT, "l2": faiss.METRIC_L2}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("kind", choices=sorted(BUILDERS))
+    parser.add_argument("--metric", choices=sorted(METRICS), default="ip")
+    parser.add_argument("--path", default=INDEX_PATH)
+    args = parser.parse_args()
+
+    src = faiss.read_index(args.path)
+    xb = src.reconstruct_n(0, src.ntotal)
+    print(f"Loaded {src.ntotal} vectors (d={src.d}) from {args.path}")
+
+    metric = METRICS[args.metric]
+    if metric == faiss.METRIC_INNER_PRODUCT:
+        faiss.normalize_L2(xb)
+    dst = BUILDERS[args.kind](xb, metric)
+    faiss.write_index(dst, args.path)
+    print(f"Wrote {type(dst).__name__} to {args.path}")
+
+if __name__ == "__main__":
+    main()
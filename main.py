@@ -1,16 +1,460 @@
-import os, pickle, traceback, json
+import os, io, re, time, pickle, traceback, json, asyncio, hashlib, threading, queue
+from functools import lru_cache
+from itertools import islice
 from flask import Flask, request, jsonify
 from googleapiclient.discovery import build
-import openai, faiss
+from google_auth_httplib2 import AuthorizedHttp
+from google.oauth2 import service_account
+import google.auth, httplib2
+from openai import OpenAI, AsyncOpenAI, NotFoundError
+import numpy as np
+import faiss
 
 app = Flask(__name__)
 
-# 1) Load the FAISS index once
+# Clients are built once per worker process, on first use, and shared by every request
+_openai_lock   = threading.Lock()
+_openai_client = None
+
+def openai_client():
+    """Sync OpenAI client, built on first use so the module imports without OPENAI_API_KEY set."""
+    global _openai_client
+    with _openai_lock:
+        if _openai_client is None:
+            _openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        return _openai_client
+
+GOOGLE_SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets.readonly",
+    "https://www.googleapis.com/auth/documents",
+]
+GOOGLE_HTTP_TIMEOUT = 60
+
+def _service_account_info():
+    # Hosts that store the key JSON as a quoted string hand it to us encoded twice
+    raw = os.getenv("GOOGLE_SERVICE_ACCOUNT")
+    if not raw:
+        return None
+    info = json.loads(raw)
+    return json.loads(info) if isinstance(info, str) else info
+
+_google_lock     = threading.Lock()
+_google_creds    = None
+_google_services = {}
+_google_http     = threading.local()
+
+def google_credentials():
+    """One credentials object per process, so the OAuth token is fetched once and refreshed in place."""
+    global _google_creds
+    with _google_lock:
+        if _google_creds is None:
+            # Parsed here rather than at import so a bad key fails the request, not the worker
+            sa_info = _service_account_info()
+            if sa_info:
+                _google_creds = service_account.Credentials.from_service_account_info(sa_info, scopes=GOOGLE_SCOPES)
+            else:
+                _google_creds, _ = google.auth.default(scopes=GOOGLE_SCOPES)
+        return _google_creds
+
+def google_http():
+    """Authorized connection for the current thread, kept alive across requests to skip repeat TLS handshakes."""
+    # httplib2 is not thread-safe, so each worker thread gets its own connection
+    if not hasattr(_google_http, "http"):
+        _google_http.http = AuthorizedHttp(google_credentials(), http=httplib2.Http(timeout=GOOGLE_HTTP_TIMEOUT))
+    return _google_http.http
+
+def google_service(name, version):
+    """Google API client for (name, version), built on first use and reused afterwards."""
+    creds = google_credentials()
+    with _google_lock:
+        if (name, version) not in _google_services:
+            # Use the discovery documents bundled with google-api-python-client instead of fetching them
+            _google_services[(name, version)] = build(
+                name, version, credentials=creds, static_discovery=True, cache_discovery=False
+            )
+        return _google_services[(name, version)]
+
+# FAISS index and retrieval, loaded once per worker process
+HNSW_EF_SEARCH = 64   # only used when build_index.py has converted the index to HNSW
+
+index = faiss.read_index("faiss_index/index.faiss")
+if isinstance(index, faiss.IndexHNSW):
+    index.hnsw.efSearch = HNSW_EF_SEARCH
 with open("faiss_index/index.pkl","rb") as f:
-    faiss_index = pickle.load(f)
+    docstore, index_to_docstore_id = pickle.load(f)
+
+# Small inner-product corpora are searched with one BLAS matmul instead of going through FAISS
+SMALL_INDEX_MAX = 50_000
+corpus = None
+if isinstance(index, faiss.IndexFlatIP) and index.ntotal < SMALL_INDEX_MAX:
+    corpus = index.reconstruct_n(0, index.ntotal)
+
+EMBED_MODEL   = "text-embedding-ada-002"   # must match the model faiss_index/ was built with
+EMB_CACHE_DIR = os.getenv("EMB_CACHE_DIR", "emb_cache")
+TOP_K         = 3      # passages retrieved per requirement
+CONTEXT_CHARS = 2000   # passages are long; keep the head of each one
+EMBED_BATCH   = 1000   # inputs per embeddings request; the API accepts up to 2048
+
+def chunked(iterable, size):
+    it = iter(iterable)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+def _emb_path(text):
+    key = hashlib.sha256(f"{EMBED_MODEL}\0{text}".encode("utf-8")).hexdigest()
+    return os.path.join(EMB_CACHE_DIR, f"{key}.npy")
+
+def _save_embedding(path, vec):
+    # Write then rename so a concurrent reader never sees a partial file
+    os.makedirs(EMB_CACHE_DIR, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, vec)
+    os.replace(tmp, path)
+
+@lru_cache(maxsize=4096)
+def embed_query(text):
+    """Embedding for `text`, served from the on-disk cache when this text was embedded before."""
+    path = _emb_path(text)
+    try:
+        vec = np.load(path)
+    except FileNotFoundError:
+        resp = openai_client().embeddings.create(model=EMBED_MODEL, input=text)
+        vec = np.asarray(resp.data[0].embedding, dtype="float32")
+        _save_embedding(path, vec)
+    vec.setflags(write=False)   # shared by every caller through lru_cache
+    return vec
+
+def embed_texts(texts):
+    """(len(texts), d) embedding matrix; texts missing from the disk cache are fetched EMBED_BATCH per request."""
+    misses = [text for text in dict.fromkeys(texts) if not os.path.exists(_emb_path(text))]
+    for batch in chunked(misses, EMBED_BATCH):
+        resp = openai_client().embeddings.create(model=EMBED_MODEL, input=batch)
+        for item in resp.data:
+            _save_embedding(_emb_path(batch[item.index]), np.asarray(item.embedding, dtype="float32"))
+    if misses:
+        print(f"Embedded {len(misses)} new texts")
+    return np.stack([embed_query(text) for text in texts])
+
+def search_index(xq, k):
+    """Row ids of the k best matches for each query, best first."""
+    if corpus is None:
+        return index.search(xq, k)[1]
+    k = min(k, len(corpus))
+    scores = xq @ corpus.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+def retrieve_contexts(texts):
+    """Supporting passages for each text, searched as one query matrix; blank texts get no context."""
+    # The embeddings endpoint rejects empty input, and a blank requirement has nothing to search for
+    wanted = [i for i, text in enumerate(texts) if text.strip()]
+    contexts = [""] * len(texts)
+    if not wanted:
+        return contexts
+    xq = embed_texts([texts[i] for i in wanted])
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        faiss.normalize_L2(xq)   # corpus was normalised by build_index.py, so IP == cosine
+    ids = search_index(xq, TOP_K)
+    for i, row_ids in zip(wanted, ids):
+        passages = [docstore.search(index_to_docstore_id[j]).page_content for j in row_ids if j != -1]
+        contexts[i] = "\n\n".join(p[:CONTEXT_CHARS] for p in passages)
+    return contexts
+
+# Generation: live completions for /start, Batch API jobs for /start_batch
+MODEL           = "gpt-4o"
+MAX_CONCURRENCY = 20   # in-flight completions per request, keeps us under RPM limits
+BATCH_JOBS_DIR  = os.getenv("BATCH_JOBS_DIR", "batch_jobs")   # per-instance collect results and locks
+BATCH_LOCK_STALE_SECS = 900   # a collect lock older than this was left by a collect that died
+ROWS_PER_CALL   = 10   # sheet rows packed into a single completion by /start
+GENERATION_TIMEOUT_SECS = int(os.getenv("GENERATION_TIMEOUT_SECS", 900))   # per /start request
+
+def split_row(row):
+    # Sheets returns [] for a fully blank row inside the range
+    req = row[0] if row else ""
+    fnc = row[1] if len(row) > 1 else ""
+    return req, fnc
+
+def dedupe_rows(rows):
+    """Distinct rows by (requirement, functionality), plus the distinct-row index of every sheet row."""
+    seen, unique, row_map = {}, [], []
+    for row in rows:
+        key = split_row(row)
+        if key not in seen:
+            seen[key] = len(unique)
+            unique.append(row)
+        row_map.append(seen[key])
+    return unique, row_map
+
+def fan_out(row_map, emit):
+    """on_row callback for enrich_rows() over distinct rows that calls emit() once per sheet row, in sheet order."""
+    done, next_row = [], 0
+    def on_unique(text):
+        nonlocal next_row
+        done.append(text)
+        while next_row < len(row_map) and row_map[next_row] < len(done):
+            emit(done[row_map[next_row]])
+            next_row += 1
+    return on_unique
+
+# Static instructions go in the system message: identical on every call, so OpenAI can serve
+# them from its prompt cache, and only the per-row fields are rebuilt for each request.
+SYSTEM_PROMPT = (
+    "You are Fever’s RFP AI assistant.\n"
+    "You are given an RFP requirement, the Fever functionality that addresses it and context from past RFP responses. "
+    "Write a narrative-rich paragraph explaining how this functionality meets the requirement."
+)
+CHUNK_SYSTEM_PROMPT = (
+    "You are Fever’s RFP AI assistant.\n"
+    "You are given several rows, each with an RFP requirement, the Fever functionality that addresses it and context "
+    "from past RFP responses. For every row, write a narrative-rich paragraph explaining how the functionality meets "
+    "the requirement.\n"
+    'Reply with a JSON object of the form {"sections": [{"id": <row id>, "text": "<paragraph>"}, ...]} '
+    "containing exactly one entry per row."
+)
+
+def format_row(req, fnc, context):
+    return f"Requirement: {req}\nFunctionality: {fnc}\nContext from past RFP responses:\n{context}\n"
+
+def build_messages(req, fnc, context):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": format_row(req, fnc, context)},
+    ]
+
+def build_chunk_messages(chunk):
+    """Messages for several (row id, row, context) triples; the model answers with a JSON object keyed by row id."""
+    rows = [f"### ROW {i}\n{format_row(*split_row(row), context)}" for i, row, context in chunk]
+    return [
+        {"role": "system", "content": CHUNK_SYSTEM_PROMPT},
+        {"role": "user", "content": "\n".join(rows)},
+    ]
+
+async def enrich_rows(rows, contexts, on_row=None):
+    """Generate one paragraph per sheet row, ROWS_PER_CALL rows per completion, preserving row order.
+
+    on_row(text) is called in row order as soon as every earlier row is done, so callers can
+    start writing out results while later chunks are still generating.
+    """
+    # The async client is bound to the event loop, so it lives for one asyncio.run()
+    client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+    results  = [None] * len(rows)
+    next_row = 0
+
+    async def process(row, context):
+        messages = build_messages(*split_row(row), context)
+        async with sem:
+            ai_resp = await client.chat.completions.create(
+                model=MODEL, max_tokens=300, messages=messages,
+            )
+        return ai_resp.choices[0].message.content.strip()
+
+    async def process_chunk(chunk):
+        messages = build_chunk_messages(chunk)
+        async with sem:
+            ai_resp = await client.chat.completions.create(
+                model=MODEL, max_tokens=300 * len(chunk),
+                response_format={"type": "json_object"},
+                messages=messages,
+            )
+        try:
+            sections = json.loads(ai_resp.choices[0].message.content)["sections"]
+            texts = {int(s["id"]): s["text"].strip() for s in sections}
+        except (ValueError, KeyError, TypeError, AttributeError):
+            texts = {}
+
+        # Rows the model dropped (or a truncated reply) fall back to one call per row, run concurrently
+        missing = [(i, row, context) for i, row, context in chunk if not texts.get(i)]
+        if missing:
+            print(f"Rows {[i for i, _, _ in missing]} missing from chunk reply, retrying alone")
+            retried = await asyncio.gather(*(process(row, context) for _, row, context in missing))
+            texts.update(zip((i for i, _, _ in missing), retried))
+
+        nonlocal next_row
+        for i, _, _ in chunk:
+            results[i] = texts[i]
+        while next_row < len(rows) and results[next_row] is not None:
+            if on_row:
+                on_row(results[next_row])
+            next_row += 1
+
+    chunks = chunked(((i, row, contexts[i]) for i, row in enumerate(rows)), ROWS_PER_CALL)
+    tasks = [asyncio.create_task(process_chunk(c)) for c in chunks]
+    try:
+        await asyncio.gather(*tasks)
+        return results
+    except BaseException:
+        # A failed chunk (or on_row raising) stops the rest instead of paying for completions nobody uses
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        await client.close()
+
+def submit_batch(rows, contexts, row_map, doc_id):
+    """Submit one Batch API request per distinct row (half the price, up to 24h turnaround) and return the batch id.
+
+    Everything needed to collect the job lives in OpenAI's record of it: the doc id in the batch
+    metadata and, in each line's custom_id, the sheet rows that line's paragraph is written to.
+    """
+    sheet_rows = [[] for _ in rows]
+    for i, u in enumerate(row_map):
+        sheet_rows[u].append(i)
+
+    buf = io.BytesIO()
+    for row, context, targets in zip(rows, contexts, sheet_rows):
+        req, fnc = split_row(row)
+        line = {
+            "custom_id": "rows-" + ".".join(map(str, targets)),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": MODEL, "max_tokens": 300,
+                "messages": build_messages(req, fnc, context),
+            },
+        }
+        buf.write((json.dumps(line) + "\n").encode("utf-8"))
+    buf.seek(0)
+
+    batch_file = openai_client().files.create(file=("rows.jsonl", buf), purpose="batch")
+    batch = openai_client().batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+        metadata={"doc_id": doc_id},
+    )
+    print("Submitted batch", batch.id)
+    return batch.id
+
+def _sheet_rows(custom_id):
+    return [int(i) for i in custom_id.removeprefix("rows-").split(".")]
+
+def _jsonl(file_id):
+    return [json.loads(line) for line in openai_client().files.content(file_id).text.splitlines() if line.strip()]
+
+def read_batch_output(batch):
+    """Paragraphs of a finished batch keyed by sheet row index, plus the custom_ids that produced none."""
+    enriched = {}
+    if batch.output_file_id:
+        # Output lines are not guaranteed to be in input order
+        for result in _jsonl(batch.output_file_id):
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                continue
+            text = response["body"]["choices"][0]["message"]["content"].strip()
+            for i in _sheet_rows(result["custom_id"]):
+                enriched[i] = text
+    failed = [line["custom_id"] for line in _jsonl(batch.input_file_id)
+              if _sheet_rows(line["custom_id"])[0] not in enriched]
+    return enriched, failed
+
+def _batch_job_path(batch_id):
+    return os.path.join(BATCH_JOBS_DIR, f"{batch_id}.json")
 
-# 2) Configure OpenAI
-openai.api_key = os.getenv("OPENAI_API_KEY")
+def save_batch_job(batch_id, job):
+    os.makedirs(BATCH_JOBS_DIR, exist_ok=True)
+    path = _batch_job_path(batch_id)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(job, f)
+    os.replace(tmp, path)
+
+def claim_batch(batch_id):
+    """Take the collect lock for batch_id; False while another collect holds a fresh one."""
+    os.makedirs(BATCH_JOBS_DIR, exist_ok=True)
+    lock = _batch_job_path(batch_id) + ".lock"
+    try:
+        fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            with open(lock) as f:
+                since = float(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            since = 0
+        if time.time() - since < BATCH_LOCK_STALE_SECS:
+            return False
+        print(f"Taking over stale collect lock for {batch_id}")
+        fd = os.open(lock, os.O_WRONLY | os.O_TRUNC)
+    with os.fdopen(fd, "w") as f:
+        f.write(str(time.time()))
+    return True
+
+def release_batch(batch_id):
+    os.remove(_batch_job_path(batch_id) + ".lock")
+
+def load_batch_job(batch_id):
+    try:
+        with open(_batch_job_path(batch_id)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+# Google Sheets / Docs I/O
+DOCS_BATCH_SIZE = 500  # insertText requests per Docs batchUpdate
+
+def fetch_rows(sheet_id):
+    # Auto-detect the first tab name
+    sheets_svc = google_service("sheets","v4").spreadsheets()
+    meta = sheets_svc.get(
+        spreadsheetId=sheet_id,
+        fields="sheets(properties(title))"
+    ).execute(http=google_http())
+    first_tab = meta["sheets"][0]["properties"]["title"]
+    sheet_range = f"{first_tab}!A2:B"
+    print("Using range:", sheet_range)
+
+    resp = sheets_svc.values().get(
+        spreadsheetId=sheet_id, range=sheet_range, fields="values"
+    ).execute(http=google_http())
+    return resp.get("values", [])
+
+def append_to_doc(doc_id, enriched_rows, http=None, on_commit=None):
+    """Append to Google Doc in sheet order, DOCS_BATCH_SIZE inserts per batchUpdate; returns rows written.
+
+    Each batchUpdate is atomic, so on_commit(n) is called after every one that lands; if a later one
+    fails, the rows already committed have been reported.
+    """
+    http = http or google_http()
+    docs_svc = google_service("docs","v1").documents()
+    requests = [{"insertText":{
+        "endOfSegmentLocation":{},
+        "text": enriched + "\n\n"
+    }} for enriched in enriched_rows]
+    # Sequential on purpose: each batch appends at the current end of the doc
+    appended = 0
+    for batch in chunked(requests, DOCS_BATCH_SIZE):
+        docs_svc.batchUpdate(documentId=doc_id, body={"requests": batch}).execute(http=http)
+        print(f"Appended {len(batch)} rows")
+        appended += len(batch)
+        if on_commit:
+            on_commit(len(batch))
+    return appended
+
+def doc_writer(doc_id, rows_q, http, progress):
+    """Append rows from rows_q until a None sentinel, one batchUpdate for whatever has queued up.
+
+    progress["appended"] counts rows written so far; progress["error"] holds the first write failure.
+    """
+    def committed(n):
+        progress["appended"] += n
+
+    done = False
+    while not done:
+        texts = [rows_q.get()]
+        while not rows_q.empty():
+            texts.append(rows_q.get_nowait())
+        if texts[-1] is None:
+            texts.pop()
+            done = True
+        # After a failure keep draining so the producer never blocks, but stop writing
+        if texts and not progress["error"]:
+            try:
+                append_to_doc(doc_id, texts, http=http, on_commit=committed)
+            except Exception as e:
+                progress["error"] = e
 
 @app.route("/start", methods=["POST"])
 def start():
@@ -19,46 +463,46 @@ def start():
         sheet_id = data["sheet_id"]
         doc_id   = data["doc_id"]
 
-        # 3) Auto-detect the first tab name
-        sheets_svc = build("sheets","v4").spreadsheets()
-        meta = sheets_svc.get(
-            spreadsheetId=sheet_id,
-            fields="sheets(properties(title))"
-        ).execute()
-        first_tab = meta["sheets"][0]["properties"]["title"]
-        sheet_range = f"{first_tab}!A2:B"
-        print("Using range:", sheet_range)
-
-        # 4) Fetch rows
-        resp = sheets_svc.values().get(
-            spreadsheetId=sheet_id, range=sheet_range
-        ).execute()
-        rows = resp.get("values", [])
+        # 1) Fetch rows
+        rows = fetch_rows(sheet_id)
         if not rows:
             return jsonify(error="No data in sheet!"), 400
-        print(f"Fetched {len(rows)} rows")
-
-        # 5) Enrich & append to Google Doc
-        docs_svc = build("docs","v1").documents()
-        for idx, row in enumerate(rows, start=2):
-            req = row[0]
-            fnc = row[1] if len(row) > 1 else ""
-            prompt = (
-                f"You are Fever’s RFP AI assistant.\n"
-                f"Requirement: {req}\nFunctionality: {fnc}\n"
-                "Write a narrative-rich paragraph explaining how this functionality meets the requirement.\n"
-            )
-            ai_resp = openai.Completion.create(
-                model="text-davinci-003", prompt=prompt, max_tokens=300
-            )
-            enriched = ai_resp.choices[0].text.strip()
-            docs_svc.batchUpdate(documentId=doc_id, body={
-                "requests":[{"insertText":{
-                    "endOfSegmentLocation":{}, 
-                    "text": enriched + "\n\n"
-                }}]
-            }).execute()
-            print(f"Done row {idx}")
+        unique_rows, row_map = dedupe_rows(rows)
+        print(f"Fetched {len(rows)} rows ({len(unique_rows)} distinct)")
+
+        # 2) Pull supporting passages from the FAISS index
+        contexts = retrieve_contexts([split_row(row)[0] for row in unique_rows])
+
+        # 3) Enrich distinct rows concurrently; a writer thread appends finished rows to the Google Doc
+        #    meanwhile, repeating paragraphs for duplicate rows. It borrows this thread's connection,
+        #    which sits idle until we join it.
+        rows_q, progress = queue.Queue(), {"appended": 0, "error": None}
+
+        def enqueue(text):
+            # Raising here cancels the remaining chunks once the doc can no longer be written
+            if progress["error"]:
+                raise RuntimeError("Writing to the Google Doc failed") from progress["error"]
+            rows_q.put(text)
+
+        writer = threading.Thread(target=doc_writer, args=(doc_id, rows_q, google_http(), progress))
+        writer.start()
+        try:
+            asyncio.run(asyncio.wait_for(
+                enrich_rows(unique_rows, contexts, on_row=fan_out(row_map, enqueue)),
+                GENERATION_TIMEOUT_SECS,
+            ))
+            failure = progress["error"]
+        except Exception as e:
+            failure = e
+        finally:
+            rows_q.put(None)
+            writer.join()
+        failure = failure or progress["error"]
+        if failure:
+            # Some rows may already be in the doc; say how many so a retry doesn't duplicate them
+            traceback.print_exception(failure)
+            return jsonify(error="Internal error", appended=progress["appended"], rows=len(rows)), 500
+        print(f"Generated {len(unique_rows)} paragraphs, appended {progress['appended']}")
 
         return jsonify(status="complete", rows=len(rows)), 200
 
@@ -66,5 +510,99 @@ def start():
         traceback.print_exc()
         return jsonify(error="Internal error"), 500
 
+@app.route("/start_batch", methods=["POST"])
+def start_batch():
+    try:
+        data     = request.get_json()
+        sheet_id = data["sheet_id"]
+        doc_id   = data["doc_id"]
+
+        rows = fetch_rows(sheet_id)
+        if not rows:
+            return jsonify(error="No data in sheet!"), 400
+        unique_rows, row_map = dedupe_rows(rows)
+        print(f"Fetched {len(rows)} rows ({len(unique_rows)} distinct)")
+
+        contexts = retrieve_contexts([split_row(row)[0] for row in unique_rows])
+
+        # Returns straight away; POST /start_batch/<batch_id> appends the results once the job is done
+        batch_id = submit_batch(unique_rows, contexts, row_map, doc_id)
+
+        return jsonify(status="submitted", batch_id=batch_id, rows=len(rows)), 202
+
+    except Exception:
+        traceback.print_exc()
+        return jsonify(error="Internal error"), 500
+
+@app.route("/start_batch/<batch_id>", methods=["POST"])
+def collect_batch(batch_id):
+    try:
+        if not re.fullmatch(r"batch_\w+", batch_id):
+            return jsonify(error="Unknown batch"), 404
+        job = load_batch_job(batch_id) or {}
+        if "result" in job:
+            return jsonify(job["result"]), 200   # already appended, don't write the rows twice
+
+        try:
+            batch = openai_client().batches.retrieve(batch_id)
+        except NotFoundError:
+            return jsonify(error="Unknown batch"), 404
+        doc_id = (batch.metadata or {}).get("doc_id")
+        if not doc_id:
+            return jsonify(error="Batch was not submitted by /start_batch"), 404
+        print(f"Batch {batch_id}: {batch.status}")
+        if batch.status not in ("completed", "failed", "expired", "cancelled"):
+            return jsonify(status=batch.status, batch_id=batch_id), 202
+
+        # Claim the job so two concurrent collects can't both append it
+        if not claim_batch(batch_id):
+            return jsonify(error="Batch is already being collected", batch_id=batch_id), 409
+
+        progress = {"appended": 0}
+        def committed(n):
+            progress["appended"] += n
+
+        try:
+            try:
+                enriched, failed = read_batch_output(batch)
+            except NotFoundError:
+                # The output file is deleted once its rows are in the doc (possibly by another instance)
+                release_batch(batch_id)
+                return jsonify(status="collected", batch_id=batch_id), 200
+            enriched_rows = [enriched[i] for i in sorted(enriched)]
+            failed_rows   = sorted(i + 2 for custom_id in failed for i in _sheet_rows(custom_id))
+            append_to_doc(doc_id, enriched_rows, on_commit=committed)
+            print(f"Appended {len(enriched_rows)} rows, {len(failed_rows)} failed")
+        except Exception:
+            # Nothing written yet: let the next collect retry. Otherwise keep the lock so a retry can't
+            # write the committed rows a second time; it goes stale after BATCH_LOCK_STALE_SECS.
+            if not progress["appended"]:
+                release_batch(batch_id)
+            traceback.print_exc()
+            return jsonify(error="Internal error", batch_id=batch_id, appended=progress["appended"]), 500
+
+        job["result"] = dict(
+            status="complete" if not failed else "partial" if enriched else "failed",
+            batch_id=batch_id, batch_status=batch.status,
+            rows=len(enriched_rows), failed=failed, failed_rows=failed_rows,
+        )
+        # From here the rows are in the doc and the lock is never released, so a failure below
+        # cannot lead to a second append. Deleting the output file marks the batch collected for
+        # every instance; the saved result lets this one answer repeat calls in full.
+        for step in (
+            lambda: batch.output_file_id and openai_client().files.delete(batch.output_file_id),
+            lambda: save_batch_job(batch_id, job),
+        ):
+            try:
+                step()
+            except Exception:
+                traceback.print_exc()
+
+        return jsonify(job["result"]), 200
+
+    except Exception:
+        traceback.print_exc()
+        return jsonify(error="Internal error"), 500
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT",8080)))